@@ -7,13 +7,16 @@ A unified web interface for managing self-hosted Overleaf users and Zotero proxy
 import os
 import json
 import secrets
+import threading
+import time
 from datetime import datetime
 from functools import wraps
 
 import re
 
-from flask import Flask, render_template, request, jsonify, redirect, url_for, session, flash, abort, Response
+from flask import Flask, render_template, request, jsonify, redirect, url_for, session, flash, abort, Response, stream_with_context
 from flask_cors import CORS
+from werkzeug.exceptions import HTTPException
 from werkzeug.security import generate_password_hash, check_password_hash
 from werkzeug.middleware.proxy_fix import ProxyFix
 
@@ -25,6 +28,27 @@ from models.zotero import ZoteroProxyManager
 app = Flask(__name__)
 app.config.from_object(Config)
 
+# Serialize API responses with orjson when available: jsonify otherwise goes
+# through stdlib json, which is several times slower on the larger payloads
+# (user and proxy listings). default=str keeps ObjectId and other Mongo types
+# serializable the same way the review downloads handle them.
+try:
+    import orjson
+    from flask.json.provider import JSONProvider
+
+    class OrjsonProvider(JSONProvider):
+        """Flask JSON provider backed by orjson."""
+
+        def dumps(self, obj, **kwargs):
+            return orjson.dumps(obj, default=str).decode('utf-8')
+
+        def loads(self, s, **kwargs):
+            return orjson.loads(s)
+
+    app.json = OrjsonProvider(app)
+except ImportError:
+    pass  # stdlib json remains the default provider
+
 # Enable proxy support when behind Cloudflare/reverse proxy
 # This allows Flask to read X-Forwarded-* headers correctly
 if app.config.get('BEHIND_PROXY', False):
@@ -38,6 +62,23 @@ if app.config.get('BEHIND_PROXY', False):
 
 CORS(app)
 
+# Server-side sessions in Redis when configured: the cookie shrinks to a bare
+# session id and each request costs one GET instead of HMAC-verify + unpickle
+# of the full payload. Falls back to signed-cookie sessions when unset or when
+# Flask-Session/redis are unavailable, so the dashboard still comes up.
+if app.config.get('SESSION_REDIS_URL'):
+    try:
+        import redis
+        from flask_session import Session
+        app.config['SESSION_TYPE'] = 'redis'
+        app.config['SESSION_REDIS'] = redis.Redis.from_url(app.config['SESSION_REDIS_URL'])
+        Session(app)
+    except Exception as e:
+        import logging
+        logging.getLogger(__name__).warning(
+            f"Redis session store unavailable ({e}), using cookie sessions"
+        )
+
 # Initialize managers
 overleaf_manager = OverleafManager(app.config['MONGODB_URI'])
 zotero_manager = ZoteroProxyManager(
@@ -45,12 +86,46 @@ zotero_manager = ZoteroProxyManager(
     app.config['ZOTERO_PROXY_IMAGE']
 )
 
+# In-process cache of authenticated session tokens. The password check (and,
+# when ADMIN_PASSWORD_HASH is set, the pbkdf2 verification) runs only at login;
+# afterwards each request just looks up the random token minted for the
+# session. Entries expire so a restart or TTL lapse falls back to re-login.
+_AUTH_CACHE_TTL = 300  # seconds
+_auth_cache = {}
+_auth_cache_lock = threading.Lock()
+
+def _auth_cache_put(token):
+    with _auth_cache_lock:
+        _auth_cache[token] = time.monotonic() + _AUTH_CACHE_TTL
+
+def _auth_cache_check(token):
+    """Return True if the token is cached and fresh, evicting it if stale."""
+    with _auth_cache_lock:
+        expiry = _auth_cache.get(token)
+        if expiry is None:
+            return False
+        if expiry < time.monotonic():
+            del _auth_cache[token]
+            return False
+        return True
+
+def _auth_cache_drop(token):
+    with _auth_cache_lock:
+        _auth_cache.pop(token, None)
+
 # Authentication decorator
 def login_required(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
+        token = session.get('auth_token')
+        if token and _auth_cache_check(token):
+            return f(*args, **kwargs)
         if 'logged_in' not in session:
             return redirect(url_for('login'))
+        # Logged-in session whose cache entry expired (or pre-dates a restart):
+        # re-prime the cache so subsequent requests take the fast path.
+        if token:
+            _auth_cache_put(token)
         return f(*args, **kwargs)
     return decorated_function
 
@@ -59,19 +134,25 @@ def login_required(f):
 def inject_lab_name():
     return dict(lab_name=app.config['LAB_NAME'])
 
+# Signup-subdomain matching, precomputed once: the landing page runs this on
+# every hit, so the per-request work is a partition plus one prefix check
+# against constants instead of rebuilding the candidate strings each time.
+_SIGNUP_SUBDOMAIN = app.config.get('SIGNUP_SUBDOMAIN', '')
+_SIGNUP_PREFIX = _SIGNUP_SUBDOMAIN + '.' if _SIGNUP_SUBDOMAIN else ''
+
+# Same charset ZoteroProxyManager.add_proxy accepts, compiled once
+_USERNAME_RE = re.compile(r'^[a-z0-9-]+$')
+
 # Routes
 @app.route('/')
 def index():
     """Redirect to appropriate page based on hostname and login status."""
-    # If coming from signup subdomain, redirect to public registration
-    signup_subdomain = app.config.get('SIGNUP_SUBDOMAIN', '')
-
-    # Check if request comes from signup hostname
-    # request.host may include port, so we check the hostname part
-    if signup_subdomain:
-        hostname = request.host.split(':')[0]  # Remove port if present
-        # Check if hostname starts with the signup subdomain (e.g., "zotero-signup")
-        if hostname.startswith(signup_subdomain + '.') or hostname == signup_subdomain:
+    # If coming from signup subdomain (e.g. "zotero-signup"), redirect to the
+    # public registration page. request.host may include a port, so only the
+    # hostname part is compared.
+    if _SIGNUP_SUBDOMAIN:
+        hostname = request.host.partition(':')[0]
+        if hostname == _SIGNUP_SUBDOMAIN or hostname.startswith(_SIGNUP_PREFIX):
             return redirect(url_for('zotero_signup'))
 
     # Otherwise normal behavior: dashboard if logged in, login if not
@@ -93,6 +174,9 @@ def login():
         ):
             session['logged_in'] = True
             session['username'] = username
+            token = secrets.token_urlsafe(32)
+            session['auth_token'] = token
+            _auth_cache_put(token)
             flash('Logged in successfully!', 'success')
             return redirect(url_for('dashboard'))
         else:
@@ -103,6 +187,9 @@ def login():
 @app.route('/logout')
 def logout():
     """Logout the user."""
+    token = session.get('auth_token')
+    if token:
+        _auth_cache_drop(token)
     session.clear()
     flash('Logged out successfully!', 'info')
     return redirect(url_for('login'))
@@ -125,153 +212,143 @@ def dashboard():
 @app.route('/api/overleaf/users', methods=['GET'])
 @login_required
 def get_overleaf_users():
-    """Get all Overleaf users."""
-    try:
-        users = overleaf_manager.list_users()
-        return jsonify({'success': True, 'users': users})
-    except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
+    """Get all Overleaf users.
+
+    Streamed row by row: the response has the same shape the frontend already
+    consumes, but only one serialized user is held in memory at a time instead
+    of the full list plus its JSON copy.
+    """
+    def generate(users, first_user):
+        yield '{"success": true, "users": ['
+        if first_user is not None:
+            yield app.json.dumps(first_user)
+            for user in users:
+                yield ','
+                yield app.json.dumps(user)
+        yield ']}'
+
+    # Run the aggregation and pull the first row before committing to the
+    # stream: a MongoDB failure here still raises into the JSON 500 handler,
+    # instead of aborting a 200 response that already began with success=true.
+    users = overleaf_manager.iter_users()
+    first_user = next(users, None)
+    return Response(stream_with_context(generate(users, first_user)), mimetype='application/json')
 
 @app.route('/api/overleaf/users', methods=['POST'])
 @login_required
 def create_overleaf_user():
     """Create a new Overleaf user."""
-    try:
-        data = request.json
-        email = data.get('email')
-        password = data.get('password')  # Opzionale
-        is_admin = data.get('is_admin', False)
-        
-        if not email:  # ← SOLO EMAIL OBBLIGATORIA
-            return jsonify({'success': False, 'error': 'Email is required'}), 400
-        
-        result = overleaf_manager.create_user(email, password, is_admin)
-        return jsonify(result)
-    except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
+    data = request.json
+    email = data.get('email')
+    password = data.get('password')  # Opzionale
+    is_admin = data.get('is_admin', False)
+    
+    if not email:  # ← SOLO EMAIL OBBLIGATORIA
+        return jsonify({'success': False, 'error': 'Email is required'}), 400
+    
+    result = overleaf_manager.create_user(email, password, is_admin)
+    return jsonify(result)
 
 @app.route('/api/overleaf/users/<email>', methods=['DELETE'])
 @login_required
 def delete_overleaf_user(email):
     """Delete an Overleaf user."""
-    try:
-        result = overleaf_manager.delete_user(email)
-        return jsonify(result)
-    except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
+    result = overleaf_manager.delete_user(email)
+    return jsonify(result)
 
 @app.route('/api/overleaf/users/<email>/admin', methods=['PUT'])
 @login_required
 def toggle_admin_status(email):
     """Toggle admin status for an Overleaf user."""
-    try:
-        data = request.json
-        is_admin = data.get('is_admin', False)
-        result = overleaf_manager.set_admin_status(email, is_admin)
-        return jsonify(result)
-    except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
+    data = request.json
+    is_admin = data.get('is_admin', False)
+    result = overleaf_manager.set_admin_status(email, is_admin)
+    return jsonify(result)
 
 @app.route('/api/overleaf/users/<email>/super-admin', methods=['PUT'])
 @login_required
 def toggle_super_admin_status(email):
     """Toggle super_admin role for an Overleaf user."""
-    try:
-        data = request.json
-        is_super_admin = data.get('is_super_admin', False)
-        result = overleaf_manager.set_super_admin_status(email, is_super_admin)
-        return jsonify(result)
-    except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
+    data = request.json
+    is_super_admin = data.get('is_super_admin', False)
+    result = overleaf_manager.set_super_admin_status(email, is_super_admin)
+    return jsonify(result)
 
 # Zotero API endpoints
 @app.route('/api/zotero/proxies', methods=['GET'])
 @login_required
 def get_zotero_proxies():
     """Get all Zotero proxies."""
-    try:
-        proxies = zotero_manager.list_proxies()
-        return jsonify({'success': True, 'proxies': proxies})
-    except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
+    proxies = zotero_manager.list_proxies()
+    return jsonify({'success': True, 'proxies': proxies})
 
 @app.route('/api/zotero/proxies', methods=['POST'])
 def create_zotero_proxy():
     """Create a new Zotero proxy."""
-    try:
-        data = request.json
+    data = request.json
 
-        # DEBUG: Log received data
-        import logging
-        logging.getLogger(__name__).info(f"Received proxy creation request: {data}")
+    # DEBUG: Log received data
+    import logging
+    logging.getLogger(__name__).info(f"Received proxy creation request: {data}")
 
-        username = data.get('username')
-        api_key = data.get('api_key')
-        user_id = data.get('user_id', '')
-        entity_type = data.get('entity_type', 'user')
+    username = data.get('username')
+    api_key = data.get('api_key')
+    user_id = data.get('user_id', '')
+    entity_type = data.get('entity_type', 'user')
 
-        # For personal libraries, user_id is optional (auto-detected from API key)
-        # For groups, user_id is required
-        if not username or not api_key:
-            return jsonify({'success': False, 'error': 'Username and API key are required'}), 400
+    # For personal libraries, user_id is optional (auto-detected from API key)
+    # For groups, user_id is required
+    if not username or not api_key:
+        return jsonify({'success': False, 'error': 'Username and API key are required'}), 400
 
-        if entity_type == 'group' and not user_id:
-            return jsonify({'success': False, 'error': 'Group ID is required for group libraries'}), 400
+    if entity_type == 'group' and not user_id:
+        return jsonify({'success': False, 'error': 'Group ID is required for group libraries'}), 400
 
-        # DEBUG: Log entity_type
-        logging.getLogger(__name__).info(f"Entity type received: '{entity_type}'")
+    # DEBUG: Log entity_type
+    logging.getLogger(__name__).info(f"Entity type received: '{entity_type}'")
 
-        # Validate username (lowercase, no spaces)
-        username = username.lower().strip()
-        if ' ' in username or not username.isalnum() and '-' not in username:
-            return jsonify({'success': False, 'error': 'Username must be lowercase with no spaces'}), 400
+    # Validate username (lowercase, no spaces). Matches the rule add_proxy
+    # enforces; the old hand-rolled check had an operator-precedence bug that
+    # let usernames like "a b-c" through.
+    username = username.lower().strip()
+    if not _USERNAME_RE.match(username):
+        return jsonify({'success': False, 'error': 'Username must be lowercase with no spaces'}), 400
 
-        result = zotero_manager.add_proxy(username, api_key, user_id, entity_type)
-        return jsonify(result)
-    except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
+    result = zotero_manager.add_proxy(username, api_key, user_id, entity_type)
+    return jsonify(result)
 
 @app.route('/api/zotero/proxies/<username>', methods=['PUT'])
 @login_required
 def update_zotero_proxy(username):
     """Update a Zotero proxy."""
-    try:
-        data = request.json
-        api_key = data.get('api_key')
-        user_id = data.get('user_id')
-        entity_type = data.get('entity_type')  # Optional, will preserve existing if not provided
+    data = request.json
+    api_key = data.get('api_key')
+    user_id = data.get('user_id')
+    entity_type = data.get('entity_type')  # Optional, will preserve existing if not provided
 
-        if not api_key or not user_id:
-            return jsonify({'success': False, 'error': 'API key and User ID are required'}), 400
+    if not api_key or not user_id:
+        return jsonify({'success': False, 'error': 'API key and User ID are required'}), 400
 
-        result = zotero_manager.update_proxy(username, api_key, user_id, entity_type)
-        return jsonify(result)
-    except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
+    result = zotero_manager.update_proxy(username, api_key, user_id, entity_type)
+    return jsonify(result)
 
 @app.route('/api/zotero/proxies/<username>', methods=['DELETE'])
 @login_required
 def delete_zotero_proxy(username):
     """Delete a Zotero proxy."""
-    try:
-        result = zotero_manager.remove_proxy(username)
-        return jsonify(result)
-    except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
+    result = zotero_manager.remove_proxy(username)
+    return jsonify(result)
 
 @app.route('/api/system/status', methods=['GET'])
 @login_required
 def get_system_status():
     """Get system status."""
-    try:
-        status = {
-            'mongodb': overleaf_manager.check_connection(),
-            'docker': zotero_manager.check_docker(),
-            'timestamp': datetime.now().isoformat()
-        }
-        return jsonify({'success': True, 'status': status})
-    except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
+    status = {
+        'mongodb': overleaf_manager.check_connection(),
+        'docker': zotero_manager.check_docker(),
+        'timestamp': datetime.now().isoformat()
+    }
+    return jsonify({'success': True, 'status': status})
 
 # Template pages
 @app.route('/overleaf')
@@ -399,37 +476,28 @@ def export_reviews():
 @login_required
 def get_sessions():
     """Get active sessions."""
-    try:
-        sessions = overleaf_manager.get_active_sessions()
-        return jsonify({'success': True, 'sessions': sessions})
-    except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
+    sessions = overleaf_manager.get_active_sessions()
+    return jsonify({'success': True, 'sessions': sessions})
 
 @app.route('/api/projects/active', methods=['GET'])
 @login_required
 def get_active_projects():
     """Get recently active projects."""
-    try:
-        projects = overleaf_manager.get_active_projects()
-        return jsonify({'success': True, 'projects': projects})
-    except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
+    projects = overleaf_manager.get_active_projects()
+    return jsonify({'success': True, 'projects': projects})
 
 @app.route('/api/overleaf/users/<email>/password', methods=['PUT'])
 @login_required
 def update_password(email):
     """Update user password."""
-    try:
-        data = request.json
-        new_password = data.get('password')
-        
-        if not new_password:
-            return jsonify({'success': False, 'error': 'Password is required'}), 400
-        
-        result = overleaf_manager.update_user_password(email, new_password)
-        return jsonify(result)
-    except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
+    data = request.json
+    new_password = data.get('password')
+    
+    if not new_password:
+        return jsonify({'success': False, 'error': 'Password is required'}), 400
+    
+    result = overleaf_manager.update_user_password(email, new_password)
+    return jsonify(result)
 
 
 # app.py
@@ -440,6 +508,21 @@ def zotero_signup():
         abort(404)
     return render_template('zotero_register.html')
 
+@app.errorhandler(Exception)
+def handle_unexpected_error(e):
+    """Turn unhandled exceptions into the generic API error response.
+
+    Replaces the identical try/except that every API view used to carry: the
+    shared handler keeps one error path instead of a per-request try frame and
+    a hand-built 500 in each function. Deliberate aborts (404s etc.) pass
+    through untouched, and non-API pages keep the rendered 500 template.
+    """
+    if isinstance(e, HTTPException):
+        return e
+    if request.path.startswith('/api/'):
+        return jsonify({'success': False, 'error': str(e)}), 500
+    return render_template('500.html'), 500
+
 @app.errorhandler(404)
 def page_not_found(e):
     """Handle 404 errors."""
@@ -49,6 +49,13 @@ class Config:
     SESSION_COOKIE_SECURE = os.environ.get('SESSION_COOKIE_SECURE', 'False').lower() == 'true'
     SESSION_COOKIE_HTTPONLY = True
     SESSION_COOKIE_SAMESITE = 'Lax'
+
+    # Server-side sessions (optional). When SESSION_REDIS_URL is set the app
+    # stores sessions in Redis via Flask-Session: the cookie then carries only
+    # a session id instead of the whole signed payload, which drops the
+    # per-request HMAC/crypto work and lets multiple workers share sessions.
+    # Leave unset to keep Flask's default signed-cookie sessions.
+    SESSION_REDIS_URL = os.environ.get('SESSION_REDIS_URL', '')
     
     # Logging
     LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO')
@@ -3,77 +3,246 @@
 import os
 import json
 import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from typing import List, Dict, Any, Optional
 import logging
 
-from pymongo import MongoClient
+from pymongo import MongoClient, WriteConcern
+from pymongo.errors import OperationFailure
 from bson import ObjectId
 from datetime import datetime, timezone
-import pytz
-import redis
+from zoneinfo import ZoneInfo
+import bcrypt
 
 logger = logging.getLogger(__name__)
 
+# Timezone objects are loaded from the zoneinfo database on construction, so
+# they are built once here and reused; _convert_to_local_time runs per field
+# per row in the listings.
+_ITALY_TZ = ZoneInfo('Europe/Rome')
+_UTC = timezone.utc
+
+# Shared MongoClients, one per URI. pymongo's connection pool is thread-safe,
+# so every Flask worker can use the same client; constructing one per manager
+# instance (or per re-import) would open a fresh pool each time and churn
+# sockets on the MongoDB side. Keyed by URI so a second manager pointed at the
+# same database reuses the warmed pool while distinct deployments still get
+# their own.
+_mongo_clients: Dict[str, MongoClient] = {}
+_mongo_client_lock = threading.Lock()
+
+
+def _get_mongo_client(mongodb_uri: str) -> MongoClient:
+    """Return the shared MongoClient for this URI, creating it on first use."""
+    client = _mongo_clients.get(mongodb_uri)
+    if client is None:
+        with _mongo_client_lock:
+            client = _mongo_clients.get(mongodb_uri)
+            if client is None:
+                client = MongoClient(
+                    mongodb_uri,
+                    maxPoolSize=50,
+                    minPoolSize=5,
+                    maxIdleTimeMS=60000,
+                    waitQueueTimeoutMS=2500,
+                    serverSelectionTimeoutMS=3000,
+                    connect=False,
+                    appname='overleaf-manager',
+                )
+                _mongo_clients[mongodb_uri] = client
+    return client
+
+
+# Lazily-created Docker SDK client. exec-ing through the SDK reuses one open
+# unix socket to the Docker daemon instead of forking a `docker` CLI process
+# (shell fork + CLI startup add hundreds of ms per call). Falls back to the
+# CLI when the SDK is not installed.
+_docker_client = None
+_docker_client_lock = threading.Lock()
+
+# Set once the first manager has ensured the MongoDB indexes
+_indexes_ensured = False
+
+# Small pool for overlapping the independent cleanup deletes in delete_user;
+# pymongo checks a connection out of the shared pool per operation, so the two
+# delete_many calls can run against the server concurrently.
+_cleanup_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='mongo-cleanup')
+
+
+def _get_docker_client():
+    """Return a shared Docker SDK client, or None when the SDK is unavailable."""
+    global _docker_client
+    if _docker_client is None:
+        with _docker_client_lock:
+            if _docker_client is None:
+                try:
+                    import docker
+                    _docker_client = docker.from_env()
+                except Exception as e:
+                    logger.debug(f"Docker SDK unavailable, using CLI: {e}")
+                    _docker_client = False
+    return _docker_client or None
+
+
 class OverleafManager:
     """Manage Overleaf users through MongoDB and Redis."""
 
     def __init__(self, mongodb_uri: str, redis_host: str = 'redis', redis_port: int = 6379):
         """Initialize the Overleaf manager."""
         self.mongodb_uri = mongodb_uri
-        self.client = MongoClient(mongodb_uri)
+        self.client = _get_mongo_client(mongodb_uri)
         self.db = self.client.sharelatex
         self.users_collection = self.db.users
-        self.italy_tz = pytz.timezone('Europe/Rome')
+        self.italy_tz = _ITALY_TZ
+
+        self._ensure_indexes()
+
+        # Short-lived cache for the dashboard counters, name -> (expiry, value).
+        # The counts change slowly and the dashboard asks for them on every
+        # render, so a 15 s TTL removes most of that Mongo traffic.
+        self._count_cache: Dict[str, Any] = {}
+
+        # Cached (expiry, ok) result of the last MongoDB liveness probe
+        self._conn_cache = None
 
-        # Redis connection for sessions
+        # Redis connection parameters for the session listing. The client is
+        # created lazily on first use so an unreachable Redis (or a missing
+        # redis package) costs nothing at startup.
+        self._redis_host = redis_host
+        self._redis_port = redis_port
+        self._redis_client = None
+        self._redis_failed = False
+        
+    def _ensure_indexes(self):
+        """Ensure the indexes behind the hot queries, once per process.
+
+        Covers the per-owner activity lookup and the lastUpdated range scans
+        (projects), the email lookups that create/delete/password paths all
+        start with (users) and the cleanup delete in delete_user (tokens).
+        create_index is a no-op when the index already exists, and failure
+        must not keep the manager from starting (e.g. Mongo briefly
+        unreachable at boot), so this is best-effort and guarded by a module
+        flag to avoid re-running on every manager construction.
+        """
+        global _indexes_ensured
+        if _indexes_ensured:
+            return
         try:
-            self.redis_client = redis.Redis(host=redis_host, port=redis_port, decode_responses=True)
-            self.redis_client.ping()
+            self.db.projects.create_index(
+                [('owner_ref', 1), ('lastUpdated', -1)], background=True
+            )
+            self.db.projects.create_index([('lastUpdated', -1)], background=True)
+            self.users_collection.create_index('email', unique=True, background=True)
+            self.db.tokens.create_index('user_id', background=True)
+            _indexes_ensured = True
         except Exception as e:
-            logger.warning(f"Redis connection failed: {e}")
-            self.redis_client = None
-        
+            logger.warning(f"Could not ensure indexes: {e}")
+
+    @property
+    def redis_client(self):
+        """Lazily-connected Redis client, or None when Redis is unreachable."""
+        if self._redis_client is None and not self._redis_failed:
+            try:
+                import redis
+                client = redis.Redis(
+                    host=self._redis_host, port=self._redis_port, decode_responses=True
+                )
+                client.ping()
+                self._redis_client = client
+            except Exception as e:
+                logger.warning(f"Redis connection failed: {e}")
+                self._redis_failed = True
+        return self._redis_client
+
     def _convert_to_local_time(self, dt):
         """Convert UTC datetime to Italy timezone."""
         if dt and isinstance(dt, datetime):
             if dt.tzinfo is None:
-                # Assume UTC if no timezone
-                dt = dt.replace(tzinfo=timezone.utc)
-            return dt.astimezone(self.italy_tz).strftime('%Y-%m-%d %H:%M')
+                # Assume UTC if no timezone (BSON datetimes are stored as UTC)
+                dt = dt.replace(tzinfo=_UTC)
+            # isoformat skips strftime's format-string machinery; the slice
+            # drops the UTC offset it appends to aware datetimes, leaving the
+            # same fixed-width 'YYYY-MM-DD HH:MM' string as the old strftime.
+            # This runs for three fields per row in the listings, so it adds up.
+            return dt.astimezone(_ITALY_TZ).isoformat(sep=' ', timespec='minutes')[:16]
         return None
         
     def check_connection(self) -> bool:
-        """Check if MongoDB is accessible."""
+        """Check if MongoDB is accessible.
+
+        The status endpoint is polled by the dashboard, so the result is
+        cached for 30 s: one live round-trip per window instead of one per
+        poll. Both outcomes are cached — a down Mongo should not be hammered
+        by the probe either.
+        """
+        if self._conn_cache and self._conn_cache[0] > time.monotonic():
+            return self._conn_cache[1]
         try:
-            self.client.server_info()
-            return True
+            # ping is the minimal liveness round-trip; server_info returned a
+            # full build-info document just to be thrown away.
+            self.client.admin.command('ping')
+            ok = True
         except Exception as e:
             logger.error(f"MongoDB connection failed: {e}")
-            return False
+            ok = False
+        self._conn_cache = (time.monotonic() + 30, ok)
+        return ok
     
     def list_users(self) -> List[Dict[str, Any]]:
         """List all Overleaf users."""
+        return list(self.iter_users())
+
+    def iter_users(self):
+        """Yield Overleaf users one at a time.
+
+        A generator so the API layer can stream the listing: only one
+        formatted row is alive at a time instead of the whole user list plus
+        its serialized copy.
+        """
         try:
-            users = []
-            for user in self.users_collection.find():
-                user_id = user.get('_id')
-                
-                # Get REAL last activity from projects
-                last_activity = None
-                if user_id:
-                    recent_project = self.db.projects.find_one(
-                        {'owner_ref': user_id},
-                        sort=[('lastUpdated', -1)]
-                    )
-                    if recent_project and 'lastUpdated' in recent_project:
-                        last_activity = recent_project['lastUpdated']
-                
+            # One aggregation for the whole listing: the projection keeps the
+            # wire payload to the fields the page renders, and the $lookup
+            # sub-pipeline pulls each user's most recent project activity via
+            # the (owner_ref, lastUpdated desc) index — sorted, limited to one
+            # document, server-side. Previously this was a separate $group
+            # over all of projects plus the user find, i.e. two round-trips
+            # and a full pass over the projects collection.
+            pipeline = [
+                {'$project': {
+                    'email': 1,
+                    'first_name': 1,
+                    'last_name': 1,
+                    'isAdmin': 1,
+                    'adminRoles': 1,
+                    'signUpDate': 1,
+                    'lastLoggedIn': 1,
+                    'features': 1,
+                    'confirmed': 1,
+                }},
+                {'$lookup': {
+                    'from': 'projects',
+                    'let': {'uid': '$_id'},
+                    'pipeline': [
+                        {'$match': {'$expr': {'$eq': ['$owner_ref', '$$uid']}}},
+                        {'$sort': {'lastUpdated': -1}},
+                        {'$limit': 1},
+                        {'$project': {'_id': 0, 'lastUpdated': 1}},
+                    ],
+                    'as': 'recent_project',
+                }},
+            ]
+            for user in self.users_collection.aggregate(pipeline, batchSize=500):
+                recent_project = user.get('recent_project')
+                last_activity = recent_project[0].get('lastUpdated') if recent_project else None
+
                 # Convert to local time
                 last_seen = self._convert_to_local_time(last_activity) or 'Never active'
                 created_at = self._convert_to_local_time(user.get('signUpDate'))
                 last_logged_in = self._convert_to_local_time(user.get('lastLoggedIn'))
                 
-                users.append({
+                yield {
                     'id': str(user.get('_id')),
                     'email': user.get('email'),
                     'first_name': user.get('first_name', ''),
@@ -85,16 +254,26 @@ class OverleafManager:
                     'last_seen': last_seen,
                     'features': user.get('features', {}),
                     'confirmed': user.get('confirmed', False)
-                })
-            return users
+                }
         except Exception as e:
             logger.error(f"Failed to list users: {e}")
             raise
     
+    def _cached_count(self, name: str, compute, ttl: int = 15) -> int:
+        """Return a cached counter, recomputing it when the TTL has lapsed."""
+        cached = self._count_cache.get(name)
+        if cached and cached[0] > time.monotonic():
+            return cached[1]
+        value = compute()
+        self._count_cache[name] = (time.monotonic() + ttl, value)
+        return value
+
     def get_user_count(self) -> int:
         """Get the total number of users."""
         try:
-            return self.users_collection.count_documents({})
+            # Unfiltered count_documents is an O(N) scan; the dashboard tile
+            # only needs the metadata-backed estimate, which is O(1).
+            return self._cached_count('users', self.users_collection.estimated_document_count)
         except Exception as e:
             logger.error(f"Failed to count users: {e}")
             return 0
@@ -103,37 +282,48 @@ class OverleafManager:
         """Create a new Overleaf user using official script."""
         try:
             # Check if user already exists
-            if self.users_collection.find_one({'email': email}):
+            if self.users_collection.find_one({'email': email}, {'_id': 1}):
                 return {'success': False, 'error': 'User already exists'}
             
             # Build command using official Overleaf script
-            cmd = [
-                'docker', 'exec', 'sharelatex', '/bin/bash', '-c',
-                f"cd /overleaf/services/web && node modules/server-ce-scripts/scripts/create-user --email={email}"
-            ]
-            
+            script = (
+                "cd /overleaf/services/web && "
+                f"node modules/server-ce-scripts/scripts/create-user --email={email}"
+            )
+
             # Add admin flag if needed
             if is_admin:
-                cmd[-1] += " --admin"
-            
+                script += " --admin"
+
             # Add password or send invitation email
             if password:
-                cmd[-1] += f" --password={password}"
+                script += f" --password={password}"
             else:
-                cmd[-1] += " --no-set-password"  # Sends email with password setup link
-            
-            # Execute command
-            result = subprocess.run(
-                cmd,
-                capture_output=True,
-                text=True,
-                check=True
-            )
-            
+                script += " --no-set-password"  # Sends email with password setup link
+
+            # Execute inside the sharelatex container: via the Docker SDK over
+            # its persistent socket when available, otherwise through the CLI.
+            docker_client = _get_docker_client()
+            if docker_client is not None:
+                container = docker_client.containers.get('sharelatex')
+                exit_code, output = container.exec_run(['/bin/bash', '-c', script])
+                if exit_code != 0:
+                    error_msg = output.decode('utf-8', 'replace') if output else f'exit code {exit_code}'
+                    logger.error(f"Failed to create user {email}: {error_msg}")
+                    return {'success': False, 'error': error_msg}
+            else:
+                subprocess.run(
+                    ['docker', 'exec', 'sharelatex', '/bin/bash', '-c', script],
+                    capture_output=True,
+                    text=True,
+                    check=True
+                )
+
             logger.info(f"Created user: {email} (admin: {is_admin})")
+            self._count_cache.pop('users', None)
             
             # Get user ID from database
-            user = self.users_collection.find_one({'email': email})
+            user = self.users_collection.find_one({'email': email}, {'_id': 1})
             user_id = str(user['_id']) if user else None
             
             return {
@@ -155,23 +345,36 @@ class OverleafManager:
     def delete_user(self, email: str) -> Dict[str, Any]:
         """Delete an Overleaf user."""
         try:
-            # Find user
-            user = self.users_collection.find_one({'email': email})
+            # Find user (only the id is needed for the cascading deletes)
+            user = self.users_collection.find_one({'email': email}, {'_id': 1})
             if not user:
                 return {'success': False, 'error': 'User not found'}
             
-            # Delete user's projects first
+            # Delete the user's projects and tokens first. The two deletes
+            # are independent, so they are submitted together and awaited
+            # before the user document itself goes; for owners with many
+            # projects this roughly halves the cleanup wall time.
+            # w=1 acknowledges the deletes after the primary applies them
+            # instead of waiting on replica acknowledgement; if a cleanup
+            # delete is lost in a failover it only leaves orphans that the
+            # next delete attempt removes, whereas the user delete below
+            # keeps the database default.
             user_id = user['_id']
-            self.db.projects.delete_many({'owner_ref': user_id})
-            
-            # Delete user's tokens
-            self.db.tokens.delete_many({'user_id': user_id})
-            
+            projects = self.db.projects.with_options(write_concern=WriteConcern(w=1))
+            tokens = self.db.tokens.with_options(write_concern=WriteConcern(w=1))
+            futures = [
+                _cleanup_executor.submit(projects.delete_many, {'owner_ref': user_id}),
+                _cleanup_executor.submit(tokens.delete_many, {'user_id': user_id}),
+            ]
+            for future in futures:
+                future.result()
+
             # Delete user
             result = self.users_collection.delete_one({'_id': user_id})
             
             if result.deleted_count:
                 logger.info(f"Deleted user: {email}")
+                self._count_cache.pop('users', None)
                 return {'success': True, 'message': f'User {email} deleted successfully'}
             else:
                 return {'success': False, 'error': 'Failed to delete user'}
@@ -232,7 +435,7 @@ class OverleafManager:
     def get_user_by_email(self, email: str) -> Dict[str, Any]:
         """Get user details by email."""
         try:
-            user = self.users_collection.find_one({'email': email})
+            user = self.users_collection.find_one({'email': email}, {'hashedPassword': 0})
             if user:
                 return {
                     'id': str(user.get('_id')),
@@ -253,32 +456,40 @@ class OverleafManager:
     def update_user_password(self, email: str, new_password: str) -> Dict[str, Any]:
         """Update user password directly in MongoDB."""
         try:
-            import bcrypt
-
-            # Check if user exists
-            user = self.users_collection.find_one({'email': email})
-            if not user:
-                return {'success': False, 'error': 'User not found'}
-
             # Hash the new password
             hashed_password = bcrypt.hashpw(new_password.encode('utf-8'), bcrypt.gensalt())
 
-            # Update password in MongoDB
+            # Update password in MongoDB. matched_count distinguishes an
+            # unknown email without a separate existence query; modified_count
+            # would be misleading here since a matched update counts as
+            # success even if the stored hash happened to be identical.
             result = self.users_collection.update_one(
                 {'email': email},
                 {'$set': {'hashedPassword': hashed_password}}
             )
 
-            if result.modified_count > 0:
-                logger.info(f"Updated password for {email}")
-                return {'success': True, 'message': 'Password updated successfully'}
-            else:
-                return {'success': False, 'error': 'Password update failed'}
+            if result.matched_count == 0:
+                return {'success': False, 'error': 'User not found'}
+
+            logger.info(f"Updated password for {email}")
+            return {'success': True, 'message': 'Password updated successfully'}
 
         except Exception as e:
             logger.error(f"Failed to update password for {email}: {e}")
             return {'success': False, 'error': str(e)}
 
+    def _email_map(self, user_ids) -> Dict[Any, str]:
+        """Resolve a batch of user ids to emails with a single $in query."""
+        ids = [uid for uid in set(user_ids) if uid is not None]
+        if not ids:
+            return {}
+        return {
+            user['_id']: user.get('email', 'Unknown')
+            for user in self.users_collection.find(
+                {'_id': {'$in': ids}}, {'email': 1}, batch_size=500
+            )
+        }
+
     def get_active_sessions(self) -> List[Dict[str, Any]]:
         """Get projects with recent activity (last 1 hour) and their collaborators."""
         try:
@@ -287,26 +498,30 @@ class OverleafManager:
             # Projects with activity in last 1 hour
             cutoff = datetime.now(timezone.utc) - timedelta(hours=1)
 
-            active_projects = []
-            for proj in self.db.projects.find(
+            projects = list(self.db.projects.find(
                 {'lastUpdated': {'$gte': cutoff}},
                 sort=[('lastUpdated', -1)]
-            ).limit(20):
-                # Get owner info
-                owner_id = proj.get('owner_ref')
-                owner = self.users_collection.find_one({'_id': owner_id}) if owner_id else None
-                owner_email = owner.get('email', 'Unknown') if owner else 'Unknown'
-
-                # Get collaborators (people who can edit)
-                collaborators = []
-                for collab_id in proj.get('collaberator_refs', []):
-                    collab = self.users_collection.find_one({'_id': collab_id})
-                    if collab:
-                        collaborators.append(collab.get('email', ''))
+            ).limit(20))
+
+            # Resolve every owner and collaborator email in one $in query
+            # instead of a find_one per id (up to ~100 round-trips for a full
+            # page of projects with collaborators).
+            emails = self._email_map(
+                [proj.get('owner_ref') for proj in projects]
+                + [cid for proj in projects for cid in proj.get('collaberator_refs', [])]
+            )
+
+            active_projects = []
+            for proj in projects:
+                collaborators = [
+                    emails[cid]
+                    for cid in proj.get('collaberator_refs', [])
+                    if cid in emails
+                ]
 
                 active_projects.append({
                     'project_name': proj.get('name', 'Untitled'),
-                    'owner_email': owner_email,
+                    'owner_email': emails.get(proj.get('owner_ref'), 'Unknown'),
                     'collaborators': collaborators,
                     'last_activity': self._convert_to_local_time(proj.get('lastUpdated')),
                 })
@@ -323,12 +538,21 @@ class OverleafManager:
                 return []
 
             sessions = []
-            # Get all session keys from Redis
-            session_keys = self.redis_client.keys("sess:*")
-
-            for key in session_keys:
+            # Walk session keys with SCAN instead of KEYS: KEYS is O(N) and
+            # blocks the (single-threaded) Redis server for its whole run,
+            # which stalls Overleaf itself. Values are then fetched with one
+            # MGET per chunk rather than a GET per key.
+            session_keys = []
+            for key in self.redis_client.scan_iter(match='sess:*', count=500):
+                session_keys.append(key)
+
+            key_values = []
+            for start in range(0, len(session_keys), 500):
+                chunk = session_keys[start:start + 500]
+                key_values.extend(zip(chunk, self.redis_client.mget(chunk)))
+
+            for key, session_data in key_values:
                 try:
-                    session_data = self.redis_client.get(key)
                     if not session_data:
                         continue
 
@@ -343,7 +567,7 @@ class OverleafManager:
                         if cookie.get('expires'):
                             try:
                                 expires_dt = datetime.fromisoformat(cookie['expires'].replace('Z', '+00:00'))
-                                expires = expires_dt.astimezone(self.italy_tz).strftime('%Y-%m-%d %H:%M')
+                                expires = expires_dt.astimezone(self.italy_tz).isoformat(sep=' ', timespec='minutes')[:16]
                             except:
                                 pass
 
@@ -370,19 +594,20 @@ class OverleafManager:
             from datetime import timedelta
             cutoff = datetime.now(timezone.utc) - timedelta(hours=24)
 
-            projects = []
-            for proj in self.db.projects.find(
+            recent = list(self.db.projects.find(
                 {'lastUpdated': {'$gte': cutoff}},
                 sort=[('lastUpdated', -1)]
-            ).limit(50):
-                # Get owner info
-                owner = self.users_collection.find_one({'_id': proj.get('owner_ref')})
-                owner_email = owner.get('email', 'Unknown') if owner else 'Unknown'
+            ).limit(50))
+
+            # One $in query for all owner emails rather than one per project
+            emails = self._email_map([proj.get('owner_ref') for proj in recent])
 
+            projects = []
+            for proj in recent:
                 projects.append({
                     'project_id': str(proj.get('_id')),
                     'name': proj.get('name', 'Untitled'),
-                    'owner_email': owner_email,
+                    'owner_email': emails.get(proj.get('owner_ref'), 'Unknown'),
                     'last_updated': self._convert_to_local_time(proj.get('lastUpdated')),
                 })
 
@@ -391,12 +616,30 @@ class OverleafManager:
             logger.error(f"Failed to get active projects: {e}")
             return []
 
+    def _count_recent_projects(self, cutoff) -> int:
+        """Count projects updated since cutoff, preferring the hinted index."""
+        query = {'lastUpdated': {'$gte': cutoff}}
+        try:
+            return self.db.projects.count_documents(query, hint=[('lastUpdated', -1)])
+        except OperationFailure:
+            # The hinted index is created best-effort at construction; if
+            # Mongo was unreachable then, the hint is 'bad' until the index
+            # exists. Fall back to the unhinted (slow but correct) count and
+            # retry the index creation for the next call.
+            logger.warning("lastUpdated index missing, counting without hint")
+            if not _indexes_ensured:
+                self._ensure_indexes()
+            return self.db.projects.count_documents(query)
+
     def get_session_count(self) -> int:
         """Get the number of projects with activity in last 1 hour."""
         try:
             from datetime import timedelta
             cutoff = datetime.now(timezone.utc) - timedelta(hours=1)
-            return self.db.projects.count_documents({'lastUpdated': {'$gte': cutoff}})
+            return self._cached_count(
+                'sessions',
+                lambda: self._count_recent_projects(cutoff),
+            )
         except Exception as e:
             logger.error(f"Failed to count active projects: {e}")
             return 0
@@ -1,7 +1,9 @@
 """Zotero proxy management module."""
 
 import os
+import time
 import yaml
+import tempfile
 import subprocess
 from datetime import datetime
 from typing import List, Dict, Any
@@ -9,8 +11,37 @@ import logging
 import re
 from pathlib import Path
 
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# Prefer the libyaml C bindings when the wheel ships them: parsing and
+# dumping the compose file is markedly faster than the pure-Python classes.
+try:
+    from yaml import CSafeLoader as _YamlLoader, CSafeDumper as _YamlDumper
+except ImportError:
+    from yaml import SafeLoader as _YamlLoader, SafeDumper as _YamlDumper
+
 logger = logging.getLogger(__name__)
 
+# Credential lines written by _update_env_file_add; one findall over the whole
+# file beats splitting and testing every line in Python.
+_ENV_LINE_RE = re.compile(r'^([A-Z0-9_]+)=(.*)$', re.M)
+
+# Usernames become container/service names; \A..\Z rejects trailing newlines
+# that $ would let through.
+_USERNAME_RE = re.compile(r'\A[a-z0-9-]+\Z')
+
+# Shared session for api.zotero.org: reuses TLS connections across the several
+# validation calls add_proxy makes (and across requests), and retries once on
+# transient connection errors.
+_zotero_session = requests.Session()
+_zotero_session.mount('https://', HTTPAdapter(
+    pool_connections=4,
+    pool_maxsize=8,
+    max_retries=Retry(total=1, backoff_factor=0.2),
+))
+
 class ZoteroProxyManager:
     """Manage Zotero proxy configurations and Docker containers."""
     
@@ -20,6 +51,14 @@ class ZoteroProxyManager:
         self.proxy_image = proxy_image
         self.docker_compose_file = self.proxies_path / 'docker-compose.yml'
         self.env_file = self.proxies_path / '.env'
+
+        # Cached list_proxies result. The listing re-parses the compose file
+        # and .env and asks Docker about every container, and the UI polls it;
+        # the cache is keyed on both files' mtimes plus a short TTL (for the
+        # container states, which can change without a file write), and is
+        # dropped explicitly by every mutating operation.
+        self._list_cache = None          # (compose_mtime, env_mtime, expiry, data)
+        self._status_cache = None        # (expiry, {container_name: state})
         
     def check_docker(self) -> bool:
         """Check if Docker is running."""
@@ -35,33 +74,50 @@ class ZoteroProxyManager:
             logger.error(f"Docker check failed: {e}")
             return False
     
+    def _load_compose(self) -> Dict[str, Any]:
+        """Parse docker-compose.yml, normalising the missing/empty cases.
+
+        Always returns a dict with a 'services' dict, so callers don't have to
+        re-handle a missing file, an empty file, or a 'services:' key holding
+        only comments (which YAML parses as None).
+        """
+        config = None
+        if self.docker_compose_file.exists():
+            with open(self.docker_compose_file, 'r') as f:
+                config = yaml.load(f, Loader=_YamlLoader)
+        if config is None:
+            config = {}
+        if config.get('services') is None:
+            config['services'] = {}
+        return config
+
+    def _file_mtime(self, path: Path) -> float:
+        try:
+            return path.stat().st_mtime
+        except OSError:
+            return 0.0
+
     def list_proxies(self) -> List[Dict[str, Any]]:
         """List all configured Zotero proxies."""
         try:
-            proxies = []
-            
-            # Read docker-compose.yml to get configured proxies
-            if self.docker_compose_file.exists():
-                with open(self.docker_compose_file, 'r') as f:
-                    compose_config = yaml.safe_load(f)
-
-                # Ensure compose_config is valid
-                if compose_config is None:
-                    compose_config = {}
+            compose_mtime = self._file_mtime(self.docker_compose_file)
+            env_mtime = self._file_mtime(self.env_file)
+            cached = self._list_cache
+            if (cached is not None
+                    and cached[0] == compose_mtime
+                    and cached[1] == env_mtime
+                    and cached[2] > time.monotonic()):
+                return cached[3]
 
-                services = compose_config.get('services', {})
-                # YAML may parse 'services:' with only comments as None
-                if services is None:
-                    services = {}
+            proxies = []
 
+            # Read docker-compose.yml to get configured proxies
+            services = self._load_compose()['services']
+            if services:
                 # Read .env file for credentials
                 env_vars = {}
                 if self.env_file.exists():
-                    with open(self.env_file, 'r') as f:
-                        for line in f:
-                            if '=' in line:
-                                key, value = line.strip().split('=', 1)
-                                env_vars[key] = value
+                    env_vars = dict(_ENV_LINE_RE.findall(self.env_file.read_text()))
 
                 # Extract proxy information
                 for service_name, service_config in services.items():
@@ -97,17 +153,23 @@ class ZoteroProxyManager:
                             'port': self._extract_port(service_config)
                         })
             
+            self._list_cache = (compose_mtime, env_mtime, time.monotonic() + 2, proxies)
             return proxies
-            
+
         except Exception as e:
             logger.error(f"Failed to list proxies: {e}")
             return []
     
     def get_proxy_count(self) -> int:
-        """Get the total number of configured proxies."""
+        """Get the total number of configured proxies.
+
+        Counts zotero- services straight from the compose file; unlike
+        list_proxies this never talks to Docker, so the dashboard counter
+        stays cheap even when the daemon is slow.
+        """
         try:
-            proxies = self.list_proxies()
-            return len(proxies)
+            services = self._load_compose()['services']
+            return sum(1 for name in services if name.startswith('zotero-'))
         except Exception:
             return 0
     
@@ -120,29 +182,29 @@ class ZoteroProxyManager:
         try:
             # Validate username
             username = username.lower().strip()
-            if not re.match(r'^[a-z0-9-]+$', username):
+            if not _USERNAME_RE.match(username):
                 return {'success': False, 'error': 'Invalid username format'}
 
             # Validate entity_type
             if entity_type not in ('user', 'group'):
                 return {'success': False, 'error': 'Invalid entity type. Must be "user" or "group".'}
 
-            # Check if proxy already exists
-            existing_proxies = self.list_proxies()
-            if any(p['username'] == username for p in existing_proxies):
+            # Check if proxy already exists (compose file only; no need to
+            # query Docker for container states here)
+            services = self._load_compose()['services']
+            if f'zotero-{username}' in services:
                 return {'success': False, 'error': 'Proxy already exists'}
 
             # VALIDATE ZOTERO CREDENTIALS
             entity_label = 'Group' if entity_type == 'group' else 'User'
             logger.info(f"Validating Zotero credentials for {entity_label.lower()}: {username}")
-            import requests
 
             try:
                 headers = {'Zotero-API-Key': api_key}
 
                 # Step 1: Verify the API key is valid
                 key_url = 'https://api.zotero.org/keys/current'
-                key_response = requests.get(key_url, headers=headers, timeout=10)
+                key_response = _zotero_session.get(key_url, headers=headers, timeout=10)
 
                 if key_response.status_code == 403:
                     return {'success': False, 'error': 'Invalid API Key. Please check your Zotero API key and try again.'}
@@ -166,7 +228,7 @@ class ZoteroProxyManager:
                     # 1. The group exists
                     # 2. The user (API key owner) is a member of the group
                     group_url = f'https://api.zotero.org/groups/{user_id}'
-                    group_response = requests.get(group_url, headers=headers, timeout=10)
+                    group_response = _zotero_session.get(group_url, headers=headers, timeout=10)
 
                     logger.info(f"Group check: {group_url} -> {group_response.status_code}")
 
@@ -214,9 +276,11 @@ class ZoteroProxyManager:
                         logger.error(f"Failed to parse group data: {e}")
                         return {'success': False, 'error': f'Invalid group data for Group ID {user_id}.'}
                 else:
-                    # For personal libraries, verify access
-                    test_url = f'https://api.zotero.org/users/{user_id}/items?limit=1'
-                    response = requests.get(test_url, headers=headers, timeout=10)
+                    # For personal libraries, verify access. format=keys makes
+                    # the server return just one item key instead of a full
+                    # serialized item; we only care about the status code.
+                    test_url = f'https://api.zotero.org/users/{user_id}/items?limit=1&format=keys'
+                    response = _zotero_session.get(test_url, headers=headers, timeout=10)
 
                     logger.info(f"Personal library check: {test_url} -> {response.status_code}")
 
@@ -234,7 +298,7 @@ class ZoteroProxyManager:
                 return {'success': False, 'error': f'Could not connect to Zotero. Please check your internet connection and try again.'}
 
             # Find next available port
-            used_ports = [p['port'] for p in existing_proxies if p['port']]
+            used_ports = [self._extract_port(cfg) for cfg in services.values()]
             next_port = 8091
             while next_port in used_ports:
                 next_port += 1
@@ -247,6 +311,7 @@ class ZoteroProxyManager:
 
             # Start the new container
             self._docker_compose_up(username)
+            self._list_cache = None
 
             logger.info(f"Added proxy for {entity_label.lower()}: {username}")
             return {
@@ -274,6 +339,7 @@ class ZoteroProxyManager:
 
             # Update .env file
             self._update_env_file_remove(username)
+            self._list_cache = None
 
             logger.info(f"Removed proxy for user: {username}")
             return {'success': True, 'message': f'Proxy for {username} removed'}
@@ -295,6 +361,7 @@ class ZoteroProxyManager:
 
             # Restart the container
             self._restart_container(f'zotero-{username}')
+            self._list_cache = None
 
             logger.info(f"Updated proxy for user: {username}")
             return {'success': True, 'message': f'Proxy for {username} updated'}
@@ -306,18 +373,39 @@ class ZoteroProxyManager:
     # Private helper methods
     def _get_container_status(self, container_name: str) -> str:
         """Get the status of a Docker container."""
+        status_map = self._container_status_map()
+        if status_map is None:
+            return 'unknown'
+        return status_map.get(container_name, 'not found')
+
+    def _container_status_map(self) -> Dict[str, str]:
+        """Fetch the state of every container in one `docker ps -a` call.
+
+        Listing N proxies used to cost N `docker inspect` round-trips; a single
+        ps call returns them all. Cached for 1 s to coalesce bursts. Returns
+        None when Docker itself is unreachable.
+        """
+        cached = self._status_cache
+        if cached and cached[0] > time.monotonic():
+            return cached[1]
         try:
             result = subprocess.run(
-                ['docker', 'inspect', container_name, '--format', '{{.State.Status}}'],
+                ['docker', 'ps', '-a', '--format', '{{.Names}}\t{{.State}}'],
                 capture_output=True,
                 text=True,
                 timeout=5
             )
-            if result.returncode == 0:
-                return result.stdout.strip()
-            return 'not found'
+            if result.returncode != 0:
+                return None
+            status_map = {}
+            for line in result.stdout.splitlines():
+                name, _, state = line.partition('\t')
+                if name:
+                    status_map[name] = state or 'unknown'
         except Exception:
-            return 'unknown'
+            return None
+        self._status_cache = (time.monotonic() + 1, status_map)
+        return status_map
     
     def _extract_port(self, service_config: dict) -> int:
         """Extract port from service configuration."""
@@ -331,19 +419,33 @@ class ZoteroProxyManager:
         except Exception:
             return None
     
+    def _write_compose(self, config: Dict[str, Any]):
+        """Atomically rewrite docker-compose.yml.
+
+        Dumps to a string first so an unchanged config costs no write (and no
+        mtime bump, which would invalidate the listing cache), then goes
+        through a temp file and os.replace like the .env writes, so a crash
+        mid-write can never leave a half-written compose file for the next
+        docker compose invocation to choke on.
+        """
+        content = yaml.dump(config, Dumper=_YamlDumper, default_flow_style=False, sort_keys=False)
+        try:
+            if self.docker_compose_file.read_text() == content:
+                return
+        except OSError:
+            pass
+        fd, tmp_path = tempfile.mkstemp(dir=str(self.proxies_path), prefix='.compose.tmp')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                f.write(content)
+            os.replace(tmp_path, self.docker_compose_file)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
     def _update_docker_compose_add(self, username: str, port: int, entity_type: str = 'user'):
         """Add service to docker-compose.yml."""
-        with open(self.docker_compose_file, 'r') as f:
-            config = yaml.safe_load(f)
-
-        # Ensure config is valid
-        if config is None:
-            config = {}
-        if 'services' not in config:
-            config['services'] = {}
-        # YAML may parse 'services:' with only comments as None
-        if config['services'] is None:
-            config['services'] = {}
+        config = self._load_compose()
 
         # Ensure networks section exists (external network for Overleaf)
         if 'networks' not in config:
@@ -372,25 +474,20 @@ class ZoteroProxyManager:
             'restart': 'unless-stopped',
             'networks': ['overleaf_default']
         }
-        
-        with open(self.docker_compose_file, 'w') as f:
-            yaml.dump(config, f, default_flow_style=False, sort_keys=False)
+
+        self._write_compose(config)
     
     def _update_docker_compose_remove(self, username: str):
         """Remove service from docker-compose.yml."""
-        with open(self.docker_compose_file, 'r') as f:
-            config = yaml.safe_load(f)
-
-        # Ensure config is valid
-        if config is None or 'services' not in config:
+        config = self._load_compose()
+        if not config['services']:
             return
 
         service_name = f'zotero-{username}'
         if service_name in config['services']:
             del config['services'][service_name]
-        
-        with open(self.docker_compose_file, 'w') as f:
-            yaml.dump(config, f, default_flow_style=False, sort_keys=False)
+
+        self._write_compose(config)
 
     def _update_env_file_add(self, username: str, api_key: str, user_id: str, entity_type: str = 'user'):
         """Add credentials to .env file."""
@@ -402,28 +499,46 @@ class ZoteroProxyManager:
             f.write(f'{env_name}_USER_ID={user_id}\n')
             f.write(f'{env_name}_ENTITY_TYPE={entity_type}\n')
     
-    def _update_env_file_remove(self, username: str):
-        """Remove credentials from .env file."""
+    def _strip_env_entries(self, username: str) -> str:
+        """Return the .env contents with the user's credential lines removed."""
         # Convert username to env var format (hyphens → underscore)
-        env_name = username.upper().replace('-', '_')
-        
+        env_name = re.escape(username.upper().replace('-', '_'))
+        pattern = re.compile(
+            rf'^{env_name}_(?:API_KEY|USER_ID|ENTITY_TYPE)=.*\n?', re.M)
+
         with open(self.env_file, 'r') as f:
-            lines = f.readlines()
-        
-        new_lines = [
-            line for line in lines
-            if not line.startswith(f'{env_name}_API_KEY=')
-            and not line.startswith(f'{env_name}_USER_ID=')
-            and not line.startswith(f'{env_name}_ENTITY_TYPE=')
-        ]
-        
-        with open(self.env_file, 'w') as f:
-            f.writelines(new_lines)
-    
+            return pattern.sub('', f.read())
+
+    def _write_env_file(self, content: str):
+        """Atomically replace the .env file.
+
+        Writing in place leaves a truncated file if the process dies
+        mid-write; writing to a temp file in the same directory and
+        os.replace'ing it is atomic on POSIX.
+        """
+        fd, tmp_path = tempfile.mkstemp(dir=str(self.proxies_path), prefix='.env.tmp')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                f.write(content)
+            os.replace(tmp_path, self.env_file)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    def _update_env_file_remove(self, username: str):
+        """Remove credentials from .env file."""
+        self._write_env_file(self._strip_env_entries(username))
+
     def _update_env_file_update(self, username: str, api_key: str, user_id: str, entity_type: str = 'user'):
-        """Update credentials in .env file."""
-        self._update_env_file_remove(username)
-        self._update_env_file_add(username, api_key, user_id, entity_type)
+        """Update credentials in .env file (single rewrite, not remove-then-append)."""
+        env_name = username.upper().replace('-', '_')
+        content = self._strip_env_entries(username)
+        if content and not content.endswith('\n'):
+            content += '\n'
+        content += (f'{env_name}_API_KEY={api_key}\n'
+                    f'{env_name}_USER_ID={user_id}\n'
+                    f'{env_name}_ENTITY_TYPE={entity_type}\n')
+        self._write_env_file(content)
     
     def _docker_compose_up(self, username: str):
         """Start a specific container."""
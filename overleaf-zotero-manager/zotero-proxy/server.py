@@ -1,24 +1,189 @@
-"""A simple Flask application to proxy Zotero API requests.
+"""A simple Quart application to proxy Zotero API requests.
 Modified version with support for personal user libraries.
 """
 
 import asyncio
+import hashlib
 import logging
 import os
+import random
+import re
+import time
+from collections import defaultdict
+from contextvars import ContextVar
 from dataclasses import dataclass
-from io import StringIO
-from textwrap import indent
 import secrets
 import json
 import aiohttp
-from flask import Flask, Response, request
+from yarl import URL
+from quart import Quart, Response, request
 from werkzeug.datastructures import MultiDict
 
+# uvloop's event loop is measurably faster than asyncio's default for this
+# kind of fan-out I/O; purely optional, everything works on the stock loop.
+try:
+    import uvloop
+    asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+except ImportError:
+    pass
+
+# orjson parses the collections payload (which can run to hundreds of KB)
+# two to three times faster than the stdlib and takes bytes directly; fall
+# back to json when it is not installed.
+try:
+    import orjson
+    _json_loads = orjson.loads
+except ImportError:
+    _json_loads = json.loads
+
 logger = logging.getLogger("zotero-proxy")
 logger.setLevel(logging.INFO)
-app = Flask(__name__)
+
+# Per-request log capture. The old approach added and removed a StringIO
+# StreamHandler on the module logger for every request, which races under
+# concurrent requests (handlers leak across requests and lines cross-
+# contaminate) and allocates a handler plus formatter each time. Instead one
+# persistent handler appends formatted lines to a context-local buffer, so
+# each request only sees its own records.
+_LOG_BUFFER: ContextVar[list[str] | None] = ContextVar("zotero_log_buffer", default=None)
+
+
+class _ContextBufferHandler(logging.Handler):
+    """Append formatted records to the current request's buffer, if any."""
+
+    def emit(self, record):
+        buffer = _LOG_BUFFER.get()
+        if buffer is not None:
+            buffer.append(self.format(record))
+
+
+_buffer_handler = _ContextBufferHandler(logging.INFO)
+_buffer_handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)7s | %(message)s"))
+logger.addHandler(_buffer_handler)
+app = Quart(__name__)
 app.secret_key = secrets.token_hex()
 
+# Sessions are cached per event loop rather than as a single module global:
+# Flask's async bridge runs each request on a fresh loop, and a ClientSession
+# is bound to the loop it was created on. Within one request every Zotero call
+# (collections plus all bibliography pages) then shares one connection pool
+# and its keep-alive TLS connections; under an ASGI server with a single
+# long-lived loop this degenerates to one persistent session for the process.
+_SESSIONS: dict[asyncio.AbstractEventLoop, aiohttp.ClientSession] = {}
+
+
+def _get_session() -> aiohttp.ClientSession:
+    """Return the shared ClientSession for the running event loop."""
+    loop = asyncio.get_running_loop()
+    session = _SESSIONS.get(loop)
+    if session is None or session.closed:
+        # drop sessions stranded on loops that have since been closed
+        for stale in [l for l in _SESSIONS if l.is_closed()]:
+            del _SESSIONS[stale]
+        session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(
+                limit=100,
+                limit_per_host=20,
+                ttl_dns_cache=300,
+                keepalive_timeout=75,
+            ),
+            timeout=aiohttp.ClientTimeout(total=30),
+            # Zotero's API is stateless; skip cookie processing entirely
+            cookie_jar=aiohttp.DummyCookieJar(),
+        )
+        _SESSIONS[loop] = session
+    return session
+
+
+# Cap on concurrently in-flight Zotero requests. An unbounded gather over a
+# large library would fire dozens of simultaneous GETs, inviting 429s; the
+# semaphore keeps the overlap but bounds it. Like sessions, semaphores are
+# per-loop since an asyncio primitive cannot be shared across loops.
+_ZOTERO_CONCURRENCY = int(os.environ.get("ZOTERO_CONCURRENCY", "8"))
+
+# Upper bound on pages fetched per listing: a misreported Total-Results of
+# 100000 would otherwise schedule a thousand page requests.
+_ZOTERO_MAX_PAGES = int(os.environ.get("ZOTERO_MAX_PAGES", "200"))
+_SEMAPHORES: dict[asyncio.AbstractEventLoop, asyncio.Semaphore] = {}
+
+
+def _get_semaphore() -> asyncio.Semaphore:
+    """Return the Zotero request semaphore for the running event loop."""
+    loop = asyncio.get_running_loop()
+    semaphore = _SEMAPHORES.get(loop)
+    if semaphore is None:
+        for stale in [l for l in _SEMAPHORES if l.is_closed()]:
+            del _SEMAPHORES[stale]
+        semaphore = asyncio.Semaphore(_ZOTERO_CONCURRENCY)
+        _SEMAPHORES[loop] = semaphore
+    return semaphore
+
+
+# Transient statuses worth retrying; anything else is handed to the caller.
+_RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+_MAX_ATTEMPTS = 5
+
+
+def _backoff_delay(attempt: int, retry_after: str | None) -> float:
+    """Jittered exponential delay, stretched to honour a Retry-After header."""
+    delay = 2**attempt + random.random()
+    if retry_after:
+        try:
+            delay = max(delay, float(retry_after))
+        except ValueError:
+            pass
+    return min(delay, 30.0)
+
+
+async def _throttled_get(
+    session: aiohttp.ClientSession, url, **kwargs
+) -> aiohttp.ClientResponse:
+    """session.get bounded by the concurrency semaphore, retrying transient failures.
+
+    Connection errors, timeouts and 429/5xx responses are retried up to
+    _MAX_ATTEMPTS times with jittered exponential backoff (a transient 503
+    used to silently drop that page's entries from the bibliography). All
+    sleeping happens while holding the semaphore slot, so when Zotero asks us
+    to slow down the whole pipeline backs off rather than immediately filling
+    the freed slot.
+    """
+    async with _get_semaphore():
+        for attempt in range(1, _MAX_ATTEMPTS + 1):
+            try:
+                response = await session.get(url, **kwargs)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as exc:
+                if attempt == _MAX_ATTEMPTS:
+                    raise
+                delay = _backoff_delay(attempt, None)
+                logger.warning(
+                    "Request failed (%s); retrying in %.1fs (attempt %s/%s)",
+                    exc, delay, attempt, _MAX_ATTEMPTS,
+                )
+                await asyncio.sleep(delay)
+                continue
+
+            backoff = response.headers.get("Backoff") or response.headers.get("Retry-After")
+            if response.status in _RETRY_STATUSES and attempt < _MAX_ATTEMPTS:
+                response.release()
+                delay = _backoff_delay(attempt, backoff)
+                logger.warning(
+                    "Zotero returned %s; retrying in %.1fs (attempt %s/%s)",
+                    response.status, delay, attempt, _MAX_ATTEMPTS,
+                )
+                await asyncio.sleep(delay)
+                continue
+
+            if backoff:
+                # asked to slow down even though the request succeeded
+                try:
+                    delay = min(float(backoff), 30.0)
+                except ValueError:
+                    delay = 0.0
+                if delay:
+                    logger.warning("Zotero asked for a %.0fs backoff", delay)
+                    await asyncio.sleep(delay)
+            return response
+
 
 def _zotero_response_is_ok(response: aiohttp.ClientResponse) -> bool:
     """Handle the response from the Zotero API. Returns true if the response is OK.
@@ -35,101 +200,232 @@ def _zotero_response_is_ok(response: aiohttp.ClientResponse) -> bool:
     return ok
 
 
-async def _zotero_batched_request(
-    url: str, headers: dict[str, str], default_parameters: dict[str, str], limit: int = 100
-) -> list[str]:
-    """Requests the url from the Zotero API. With parameter limit added to the default_parameters.
-    If the response contains the header 'Total-Results' and it larger than limit, the function
-    requests the next pages until all entries are fetched. Returns an array of all responses as
-    text."""
-    result = []
-    parameters = {**default_parameters, "limit": limit}
-
-    async with aiohttp.ClientSession() as session:
-        # get first request
-        async with session.get(
-            url, headers=headers, params=parameters, timeout=30
-        ) as initial_response:
-            logger.info("Requested %s", initial_response.request_info.url)
-            if not _zotero_response_is_ok(initial_response):
-                return result
-            total_entries = initial_response.headers["Total-Results"]
-            text = await initial_response.text()
-            result.append(text)
-
-        # create a list of (start, limit) pairs for the next pages
-        next_pages = []
-        for start in range(limit, int(total_entries), limit):
-            next_pages.append((start, limit))
-
-        # get the next pages all at once
-        tasks = []
-        for start, limit in next_pages:
-            tasks.append(
-                session.get(
-                    url,
-                    headers=headers,
-                    params={"start": start, **parameters},
-                    timeout=30,
-                )
-            )
-        # wait for all tasks to finish
-        responses = await asyncio.gather(*tasks)
-        for response in responses:
-            logger.info("Requested %s", response.request_info.url)
-            if not _zotero_response_is_ok(response):
-                continue
-            text = await response.text()
-            result.append(text)
-
-    return result
+def _total_results(response: aiohttp.ClientResponse) -> int:
+    """Parse the Total-Results header, treating a missing or garbled value as 0."""
+    raw = response.headers.get("Total-Results", "0")
+    try:
+        return int(raw)
+    except ValueError:
+        logger.warning("Unparseable Total-Results header: %r", raw)
+        return 0
+
+
+async def _fetch_first_page(
+    session: aiohttp.ClientSession, url: str, headers: dict[str, str], parameters: dict
+) -> tuple[bytes | None, int]:
+    """Fetch the first page of a listing; returns (body, total entry count).
+    Returns (None, 0) when the request failed."""
+    response = await _throttled_get(session, url, headers=headers, params=parameters)
+    async with response:
+        logger.info("Requested %s", response.request_info.url)
+        if not _zotero_response_is_ok(response):
+            return None, 0
+        return await response.read(), _total_results(response)
+
+
+async def _fetch_page(session: aiohttp.ClientSession, url, headers: dict[str, str]) -> bytes:
+    """Fetch one page, returning b"" on failure (already logged)."""
+    response = await _throttled_get(session, url, headers=headers)
+    async with response:
+        logger.info("Requested %s", response.request_info.url)
+        if not _zotero_response_is_ok(response):
+            return b""
+        return await response.read()
+
+
+def _page_requests(
+    session: aiohttp.ClientSession,
+    url: str,
+    headers: dict[str, str],
+    parameters: dict,
+    total_entries: int,
+    limit: int,
+) -> list:
+    """Coroutines fetching pages [limit, total_entries), one per page."""
+    max_entries = _ZOTERO_MAX_PAGES * limit
+    if total_entries > max_entries:
+        logger.warning(
+            "Total-Results %s exceeds ZOTERO_MAX_PAGES=%s, clamping",
+            total_entries, _ZOTERO_MAX_PAGES,
+        )
+        total_entries = max_entries
+    # Encode the shared query once; update_query only re-encodes the start
+    # value, instead of merging and percent-encoding a fresh params dict for
+    # every page.
+    base_url = URL(url).with_query(parameters)
+    return [
+        _fetch_page(session, base_url.update_query(start=start), headers)
+        for start in range(limit, total_entries, limit)
+    ]
+
+
+async def _fetch_remaining(
+    session: aiohttp.ClientSession,
+    url: str,
+    headers: dict[str, str],
+    parameters: dict,
+    total_entries: int,
+    limit: int,
+) -> list[bytes]:
+    """Fetch pages [limit, total_entries) concurrently and return their bodies."""
+    pages = await asyncio.gather(
+        *_page_requests(session, url, headers, parameters, total_entries, limit)
+    )
+    return [page for page in pages if page]
 
 
 class Collections:
-    """A class to store Zotero collection name mappings to their IDs."""
+    """A class to store Zotero collection name mappings to their IDs.
+
+    Per group, three indexes are kept so lookups never scan:
+    ``by_name`` maps full slash paths to collection IDs, ``by_id`` is the
+    reverse, and ``children_of`` maps a collection ID to the (path, id)
+    pairs of all its descendants.
+    """
+
+    # Collections rarely change mid-compile; within this window a refresh is
+    # skipped outright, beyond it a conditional GET lets Zotero answer 304.
+    TTL = 60.0
 
     def __init__(self):
-        self.data: dict[str, dict[str, str]] = {}
+        self.data: dict[str, dict[str, dict]] = {}
+        self.versions: dict[str, str] = {}
+        self.fetched_at: dict[str, float] = {}
+        # in-flight refreshes, keyed by (loop, group_id) so concurrent cache
+        # misses for the same group share one fetch instead of each firing
+        # their own (futures cannot cross event loops, hence the loop key)
+        self._pending: dict[tuple, asyncio.Future] = {}
+        # serializes writers per group so readers never observe a half-built
+        # record; keyed like _pending since locks are loop-bound too
+        self._locks: dict[tuple, asyncio.Lock] = defaultdict(asyncio.Lock)
+
+    async def _refresh(self, group_id: str, key: str, is_user: bool = False):
+        """update_from_remote with singleflight: concurrent misses for the
+        same group await the refresh that is already running."""
+        loop = asyncio.get_running_loop()
+        pending_key = (loop, group_id)
+        pending = self._pending.get(pending_key)
+        if pending is not None:
+            await asyncio.shield(pending)
+            return
+        future = loop.create_future()
+        self._pending[pending_key] = future
+        try:
+            await self.update_from_remote(group_id, key, is_user)
+        except Exception as exc:
+            future.set_exception(exc)
+            future.exception()  # mark retrieved for the no-waiters case
+            raise
+        else:
+            future.set_result(None)
+        finally:
+            self._pending.pop(pending_key, None)
 
     async def update_from_remote(self, group_id: str, key: str, is_user: bool = False):
         """Update the collection data from the Zotero API."""
+        async with self._locks[(asyncio.get_running_loop(), group_id)]:
+            await self._update_from_remote_locked(group_id, key, is_user)
+
+    async def _update_from_remote_locked(self, group_id: str, key: str, is_user: bool):
+        # TTL is re-checked under the lock: a caller that queued behind a
+        # refresh finds fresh data and returns without fetching again
+        now = time.monotonic()
+        if group_id in self.data and now - self.fetched_at.get(group_id, 0.0) < self.TTL:
+            return
+
         # Use 'users' or 'groups' depending on type
         entity_type = "users" if is_user else "groups"
         url = f"https://api.zotero.org/{entity_type}/{group_id}/collections"
         headers = {"Zotero-API-Key": key}
+        parameters = {"limit": 100}
+        session = _get_session()
+
+        # Conditional first page: when we hold data and its version, Zotero
+        # answers 304 for an unchanged library and we skip download and parse.
+        request_headers = headers
+        version = self.versions.get(group_id)
+        if version and group_id in self.data:
+            request_headers = {**headers, "If-Modified-Since-Version": version}
+
+        response = await _throttled_get(session, url, headers=request_headers, params=parameters)
+        async with response:
+            logger.info("Requested %s", response.request_info.url)
+            if response.status == 304:
+                logger.info("Collections unchanged (version %s)", version)
+                self.fetched_at[group_id] = now
+                return
+            if not _zotero_response_is_ok(response):
+                # A failed refresh must leave the cached indexes and stored
+                # version untouched: overwriting them with an empty record
+                # here, combined with the conditional GET above, would pin
+                # that empty record until the remote library next changes.
+                return
+            remote_version = response.headers.get("Last-Modified-Version")
+            total_entries = _total_results(response)
+            responses = [await response.read()]
+        responses += await _fetch_remaining(session, url, headers, parameters, total_entries, 100)
+
         collections = {}
-        responses = await _zotero_batched_request(url, headers, {})
         raw_data = []
         for response in responses:
-            raw_data += json.loads(response)
-
-        def get_collection_data(collection_id: str):
-            for collection in raw_data:
-                if collection["key"] == collection_id:
-                    return collection["data"]
-
-        def get_collection_name(collection_id: str):
-            for name, col_id in collections.items():
-                if col_id == collection_id:
-                    return name
-
-        def add_collection(collection_id: str):
-            if collection_id in collections:
-                return
-            data = get_collection_data(collection_id)
-            if data is None:
-                return
-            if data["parentCollection"]:
-                add_collection(data["parentCollection"])
-                parent_name = get_collection_name(data["parentCollection"])
-                collections[f"{parent_name}/{data['name']}"] = data["key"]
-            else:
-                collections[data["name"]] = data["key"]
+            raw_data += _json_loads(response)
+
+        # Index once up front. The previous helpers rescanned raw_data for
+        # every data lookup and the collections dict for every reverse name
+        # lookup, which made building the tree quadratic in collection count.
+        by_key = {collection["key"]: collection["data"] for collection in raw_data}
+        id_to_name: dict[str, str] = {}
+
+        def add_collection(collection_id: str) -> str | None:
+            # id_to_name doubles as a memo of fully-assembled paths: a
+            # collection named once is returned straight from the cache, so
+            # revisiting shared ancestors costs a dict hit instead of a chain
+            # walk with its per-call list/set allocations.
+            cached = id_to_name.get(collection_id)
+            if cached is not None:
+                return cached
+            # Walk up to the nearest already-named ancestor (iteratively, so a
+            # deeply nested tree can't hit the recursion limit; the seen set
+            # guards against a parent cycle in bad data), then name the chain
+            # back down.
+            chain = []
+            seen = set()
+            cursor = collection_id
+            while cursor and cursor in by_key and cursor not in id_to_name and cursor not in seen:
+                seen.add(cursor)
+                chain.append(cursor)
+                cursor = by_key[cursor]["parentCollection"]
+            for cid in reversed(chain):
+                data = by_key[cid]
+                parent = data["parentCollection"]
+                if parent:
+                    name = f"{id_to_name.get(parent)}/{data['name']}"
+                else:
+                    name = data["name"]
+                collections[name] = cid
+                id_to_name[cid] = name
+            return id_to_name.get(collection_id)
 
         for collection in raw_data:
             add_collection(collection["key"])
 
-        self.data[group_id] = collections
+        # Descendant index: each collection is listed under every ancestor,
+        # matching the old prefix scan which also matched grandchildren.
+        children_of: dict[str, list[tuple[str, str]]] = {}
+        for cid, name in id_to_name.items():
+            parent = by_key[cid]["parentCollection"] if cid in by_key else None
+            while parent:
+                children_of.setdefault(parent, []).append((name, cid))
+                parent = by_key[parent]["parentCollection"] if parent in by_key else None
+
+        self.data[group_id] = {
+            "by_name": collections,
+            "by_id": id_to_name,
+            "children_of": children_of,
+        }
+        self.fetched_at[group_id] = now
+        if remote_version:
+            self.versions[group_id] = remote_version
 
     async def get_collection_id(
         self,
@@ -139,9 +435,10 @@ class Collections:
         is_user: bool = False,
     ) -> str:
         """Get the collection ID for a given collection name."""
-        if group_id not in self.data or collection_name not in self.data[group_id]:
-            await self.update_from_remote(group_id, key, is_user)
-        return self.data[group_id][collection_name]
+        group = self.data.get(group_id)
+        if group is None or collection_name not in group["by_name"]:
+            await self._refresh(group_id, key, is_user)
+        return self.data[group_id]["by_name"][collection_name]
 
     async def get_collection_children(
         self, group_id: str, key: str, collection_id: str | None, is_user: bool = False
@@ -149,32 +446,60 @@ class Collections:
         """Get the children (collection IDs) of a collection.
         If the collection ID is None, return all collections in group."""
         # make sure data is fresh
-        if group_id not in self.data or collection_id not in self.data[group_id].values():
-            await self.update_from_remote(group_id, key, is_user)
+        group = self.data.get(group_id)
+        if group is None or collection_id not in group["by_id"]:
+            await self._refresh(group_id, key, is_user)
+            group = self.data.get(group_id)
 
-        if group_id not in self.data:
+        if group is None:
             raise ValueError("Can't access group data")
         if collection_id is None:
             logger.info("No collection provided, assuming group root-level wanted")
-            return list(self.data[group_id].items())
-        elif collection_id not in self.data[group_id].values():
+            return list(group["by_name"].items())
+        elif collection_id not in group["by_id"]:
             raise ValueError("Collection not found")
 
-        def get_collection_name(collection_id: str):
-            for name, col_id in self.data[group_id].items():
-                if col_id == collection_id:
-                    return name
-
-        collection_name = get_collection_name(collection_id)
-        children = []
-        for name, col_id in self.data[group_id].items():
-            if name.startswith(collection_name + "/"):
-                children.append((name, col_id))
-        return children
+        return group["children_of"].get(collection_id, [])
 
 
 COLLECTIONS = Collections()
 
+# Finished-bibliography cache. Overleaf polls the proxy repeatedly during a
+# session; within the TTL a poll is answered from memory instead of
+# re-downloading the whole library. Entries are keyed by everything that
+# shapes the output, and concurrent misses for the same key share one build
+# (futures keyed per loop, as elsewhere in this module).
+_BIB_CACHE: dict[tuple, tuple[float, str]] = {}
+_BIB_CACHE_TTL = float(os.environ.get("ZOTERO_BIB_TTL", "30"))
+_BIB_PENDING: dict[tuple, asyncio.Future] = {}
+
+
+async def _cached_bibliography(cache_key: tuple, build) -> str:
+    """Return the cached bibliography for cache_key, building it at most once."""
+    entry = _BIB_CACHE.get(cache_key)
+    if entry is not None and time.monotonic() - entry[0] < _BIB_CACHE_TTL:
+        logger.info("Serving bibliography from cache")
+        return entry[1]
+    loop = asyncio.get_running_loop()
+    pending_key = (loop,) + cache_key
+    pending = _BIB_PENDING.get(pending_key)
+    if pending is not None:
+        return await asyncio.shield(pending)
+    future = loop.create_future()
+    _BIB_PENDING[pending_key] = future
+    try:
+        result = await build()
+    except Exception as exc:
+        future.set_exception(exc)
+        future.exception()  # mark retrieved for the no-waiters case
+        raise
+    else:
+        _BIB_CACHE[cache_key] = (time.monotonic(), result)
+        future.set_result(result)
+        return result
+    finally:
+        _BIB_PENDING.pop(pending_key, None)
+
 
 @dataclass
 class Config:
@@ -231,6 +556,11 @@ class Config:
         elif not path:
             logger.info("No collection ID found")
             self.collection_id = None
+        elif _COLLECTION_KEY_RE.fullmatch(path):
+            # a raw collection key needs no name resolution, so skip the
+            # collections sync (and its possible remote fetch) entirely
+            logger.info("Path %r looks like a collection ID, using it directly", path)
+            self.collection_id = path
         else:  # try to get the collection ID from the path
             logger.info("Trying to get collection id from name %r", path)
             try:
@@ -266,17 +596,74 @@ class Config:
         return not error
 
 
+class BibDeduper:
+    """Incrementally deduplicate bibliography chunks as pages arrive.
+
+    Each Zotero page holds complete entries, so chunks can be processed the
+    moment they land instead of joining everything into one buffer and
+    re-splitting it at the end; the dedupe CPU overlaps with network waits.
+    Works on the raw bytes and decodes the kept entries once at the end.
+    """
+
+    def __init__(self):
+        self._all_keys = set()
+        self._fingerprints = set()
+        self._out = bytearray()
+        self._seen = 0
+        self._kept = 0
+
+    def add(self, chunk: bytes):
+        """Fold one page/collection worth of entries into the result."""
+        for entry in chunk.split(b"\n\n@"):
+            entry = entry.strip()
+            self._seen += 1
+            if not entry:
+                continue
+            if not entry.startswith(b"@"):
+                entry = b"@" + entry
+            match = _BIB_KEY_RE.match(entry)
+            # an entry without a parseable key (e.g. a comment block) dedupes
+            # on its full text instead of aborting the whole request
+            bib_key = match.group(1) if match else entry
+            # fingerprint instead of retaining every entry verbatim: a 64-bit
+            # digest per entry keeps the set a few bytes per element rather
+            # than a full copy of the bibliography
+            fingerprint = int.from_bytes(hashlib.blake2b(entry, digest_size=8).digest(), "big")
+            if fingerprint in self._fingerprints:
+                logger.warning("Duplicate entry found, deduplicating: %s", bib_key.decode(errors="replace"))
+                continue
+            self._fingerprints.add(fingerprint)
+            if bib_key in self._all_keys:
+                logger.warning("Duplicate key found: %s", bib_key.decode(errors="replace"))
+            self._all_keys.add(bib_key)
+            if self._out:
+                self._out += b"\n\n"
+            self._out += entry
+            self._kept += 1
+
+    def result(self) -> str:
+        logger.info("Removed %s duplicates", self._seen - self._kept)
+        logger.info("Returning %s entries", self._kept)
+        return bytes(self._out).decode("utf-8", errors="replace")
+
+
 async def get_bibliography(
     group_id: str,
     key: str,
     result_format: str,
+    deduper: BibDeduper,
     collection_id: str | None = None,
     is_user: bool = False,
-) -> str:
-    """Get the bibliography from the Zotero API."""
+    limit: int = 100,
+) -> None:
+    """Stream one collection's bibliography from Zotero into the deduper.
+
+    Pages are folded in as they complete rather than gathered, joined and
+    re-split afterwards, so only one copy of the payload is ever alive.
+    """
     # Use 'users' or 'groups' depending on type
     entity_type = "users" if is_user else "groups"
-    
+
     if collection_id is None:
         # Get all items from the library
         url = f"https://api.zotero.org/{entity_type}/{group_id}/items/top"
@@ -285,52 +672,42 @@ async def get_bibliography(
         url = f"https://api.zotero.org/{entity_type}/{group_id}/collections/{collection_id}/items/top"
 
     headers = {"Zotero-API-Key": key}
-    default_parameters = {
-        "format": result_format,
-        # exclude attachments, this reduces the number of requests to Zotero
-        # by default these are included in the number of items but not returned
-        # which leads to &start=100&limit=100 returning a block of ~50 items
-        "itemType": "-attachment",
-    }
-    responses = await _zotero_batched_request(url, headers, default_parameters)
-    responses = [response.strip() for response in responses]
-    return "\n\n".join(responses)
-
-
-def remove_duplicates(bibliography: str):
+    parameters = {"format": result_format, **_ITEM_FILTER_PARAMS, "limit": limit}
+    session = _get_session()
+
+    first_page, total_entries = await _fetch_first_page(session, url, headers, parameters)
+    if first_page is None:
+        return
+    deduper.add(first_page)
+    page_requests = _page_requests(session, url, headers, parameters, total_entries, limit)
+    for page in asyncio.as_completed(page_requests):
+        chunk = await page
+        if chunk:
+            deduper.add(chunk)
+
+
+# exclude attachments, this reduces the number of requests to Zotero
+# by default these are included in the number of items but not returned
+# which leads to &start=100&limit=100 returning a block of ~50 items
+_ITEM_FILTER_PARAMS = {"itemType": "-attachment"}
+
+# Citation key of a BibTeX/BibLaTeX entry: "@type{key," or "@type(key,".
+_BIB_KEY_RE = re.compile(rb"@[A-Za-z]*\s*[{(]\s*([^,\s{}]+)")
+
+# Zotero collection keys are eight uppercase alphanumerics.
+_COLLECTION_KEY_RE = re.compile(r"[A-Z0-9]{8}")
+
+
+def remove_duplicates(bibliography: bytes) -> str:
     """Remove duplicate entries from the bibliography."""
-    # split the bibliography into entries
-    entries = (bibliography).split("\n\n@")
-    no_before = len(entries)
-    all_keys = set()
-    all_entries = set()
-    result = []
-
-    for entry in entries:
-        entry = entry.strip()
-        if not entry:
-            continue
-        if not entry.startswith("@"):
-            entry = "@" + entry
-        bib_key = entry.split("{")[1].split(",")[0]
-        if entry in all_entries:
-            logger.warning("Duplicate entry found, deduplicating: %s", bib_key)
-            continue
-        all_entries.add(entry)
-        if bib_key in all_keys:
-            logger.warning("Duplicate key found: %s", bib_key)
-        all_keys.add(bib_key)
-        result.append(entry)
-
-    no_after = len(result)
-    logger.info("Removed %s duplicates", no_before - no_after)
-    logger.info("Returning %s entries", no_after)
-    return "\n\n".join(result)
+    deduper = BibDeduper()
+    deduper.add(bibliography)
+    return deduper.result()
 
 
 @app.route("/", defaults={"path": ""}, methods=["HEAD"])
 @app.route("/<path:path>", methods=["HEAD"])
-def head_handler(path):
+async def head_handler(path):
     """Quick response for HEAD requests (used by Overleaf for URL validation)."""
     return Response("", mimetype="text/plain")
 
@@ -338,15 +715,8 @@ def head_handler(path):
 @app.route("/<path:path>", methods=["GET"])
 async def main(path):
     """The main entry point for the application."""
-    # register a new logger for this request, so that we can add the logs as information
-    # to the response
-    logger_stream = StringIO()
-    logger_stream_handler = logging.StreamHandler(logger_stream)
-    logger_stream_handler.setLevel(logging.INFO)
-    logger_stream_handler.setFormatter(
-        logging.Formatter("%(asctime)s %(levelname)7s | %(message)s")
-    )
-    logger.addHandler(logger_stream_handler)
+    # collect this request's log lines so they can be prepended to the response
+    token = _LOG_BUFFER.set([])
     bibliography = ""
     remove_comments = request.args.get("remove_comments") == "true"
     try:
@@ -361,52 +731,72 @@ async def main(path):
         logger.info("  Inclusion Strategy: %s", "only-self" if config.only_self else "all")
         if config.failed_collection_lookup:
             raise ValueError(f"Failed to look up collection ID for path '{path}'")
-        children = []
-        if not config.only_self and config.collection_id:
-            children = await COLLECTIONS.get_collection_children(
-                group_id=config.group_id,
-                key=config.key,
-                collection_id=config.collection_id,
-                is_user=config.is_user,
-            )
-            if children:
-                logger.info("Including sub-collections:")
-                for name, col_id in children:
-                    logger.info("  %s: %s", name, col_id)
-        tasks = [
-            get_bibliography(
-                group_id=config.group_id,
-                key=config.key,
-                result_format=config.result_format,
-                collection_id=config.collection_id,
-                is_user=config.is_user,
-            )
-        ]
-        if children:
-            tasks += [
+
+        async def build() -> str:
+            children = []
+            if not config.only_self and config.collection_id:
+                children = await COLLECTIONS.get_collection_children(
+                    group_id=config.group_id,
+                    key=config.key,
+                    collection_id=config.collection_id,
+                    is_user=config.is_user,
+                )
+                if children:
+                    logger.info("Including sub-collections:")
+                    for name, col_id in children:
+                        logger.info("  %s: %s", name, col_id)
+            deduper = BibDeduper()
+            tasks = [
                 get_bibliography(
                     group_id=config.group_id,
                     key=config.key,
                     result_format=config.result_format,
-                    collection_id=col_id,
+                    deduper=deduper,
+                    collection_id=config.collection_id,
                     is_user=config.is_user,
                 )
-                for _, col_id in children
             ]
-        bibliographies = await asyncio.gather(*tasks)
-        bibliography = "\n\n".join(bibliographies)
-        bibliography = remove_duplicates(bibliography)
+            if children:
+                tasks += [
+                    get_bibliography(
+                        group_id=config.group_id,
+                        key=config.key,
+                        result_format=config.result_format,
+                        deduper=deduper,
+                        collection_id=col_id,
+                        is_user=config.is_user,
+                    )
+                    for _, col_id in children
+                ]
+            await asyncio.gather(*tasks)
+            return deduper.result()
+
+        cache_key = (
+            config.group_id,
+            config.collection_id,
+            config.result_format,
+            config.is_user,
+            config.only_self,
+            # the key is part of the identity: a request with a wrong or
+            # revoked key must get Zotero's 403, not a bibliography cached
+            # under someone else's valid key (digested so raw keys don't
+            # sit in a module-level dict)
+            hashlib.blake2b((config.key or "").encode(), digest_size=16).digest(),
+        )
+        bibliography = await _cached_bibliography(cache_key, build)
     except Exception:
         logger.exception("An error occurred")
     finally:
-        logs = logger_stream.getvalue()
-        logger.removeHandler(logger_stream_handler)
-        logger_stream_handler.close()
-        logger_stream.close()
+        log_lines = _LOG_BUFFER.get() or []
+        _LOG_BUFFER.reset(token)
     if remove_comments:
         result = bibliography
     else:
-        result = indent(logs, prefix="% ") + "\n\n" + bibliography
+        # Prefix the lines directly from the buffer instead of joining them
+        # into one string just for textwrap.indent to split again. The inner
+        # replace covers multi-line records such as tracebacks.
+        logs = "".join("% " + line.replace("\n", "\n% ") + "\n" for line in log_lines)
+        result = logs + "\n\n" + bibliography
     return Response(result, mimetype="text/plain")
 
 if __name__ == "__main__":